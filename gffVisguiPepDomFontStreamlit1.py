@@ -1,97 +1,147 @@
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 from matplotlib.patches import FancyBboxPatch
+from matplotlib.figure import Figure
+from matplotlib.colors import to_rgba_array
+from matplotlib.collections import EllipseCollection, PatchCollection, PolyCollection
 import streamlit as st
-from io import StringIO
+from io import BytesIO
+import csv
+import re
 import random
 
-# Function to parse the GFF file
-def parse_gff(uploaded_file):
-    domain_data = []
-    protein_names = set()
-    
-    # Read the contents of the uploaded file
-    content = uploaded_file.getvalue().decode("utf-8")
-    
-    for line in content.splitlines():
-        if line.startswith("##"):  # Skip comment lines
-            continue
-        fields = line.strip().split("\t")
-        if len(fields) < 9:
-            continue  # Skip malformed lines
-        
-        protein_name = fields[0]
-        feature_type = fields[2]
-        start = int(fields[3])
-        end = int(fields[4])
-        attributes = dict(item.split('=') for item in fields[8].split(';') if '=' in item)
-        
-        if feature_type == "polypeptide":
-            protein_names.add(protein_name)
-        
-        if feature_type == "protein_match":
-            domain_name = attributes.get("Name", "Unknown")
-            domain_data.append((protein_name, start, end, domain_name))
-    
-    return domain_data, protein_names
+# Column names of the nine tab-separated GFF fields, plus a spare one so lines ending in a tab are not skipped
+GFF_COLUMNS = ["seqid", "source", "type", "start", "end", "score", "strand", "phase", "attributes", "trailing"]
+
+# GFF columns used to build the protein and domain data
+FEATURE_COLUMNS = ["seqid", "type", "start", "end", "attributes"]
+
+# Number of GFF lines parsed per chunk
+GFF_CHUNK_ROWS = 1 << 16
+
+# Pattern capturing the value of the Name attribute in the GFF attributes column
+NAME_PATTERN = re.compile(r"(?:^|;)Name=([^;]+)")
+
+# Function to read the polypeptide/protein_match rows of a GFF file, with start/end parsed as coordinate_dtype
+def read_features(content, coordinate_dtype):
+    dtype = {column: str for column in GFF_COLUMNS} | {"start": coordinate_dtype, "end": coordinate_dtype}
+    # Only an empty coordinate counts as missing; every other field is kept as the text it is
+    na_values = {"start": [""], "end": [""]}
+
+    # Read the file in chunks, keeping only the used columns of polypeptide/protein_match rows
+    chunks = []
+    with pd.read_csv(BytesIO(content), sep="\t", header=None, names=GFF_COLUMNS,
+                     dtype=dtype, quoting=csv.QUOTE_NONE, keep_default_na=False, na_values=na_values,
+                     on_bad_lines="skip", engine="c", chunksize=GFF_CHUNK_ROWS) as reader:
+        for chunk in reader:
+            # Per GFF3 everything after the ##FASTA directive is sequence, so stop reading there
+            fasta = np.flatnonzero(chunk["seqid"].str.startswith("##FASTA", na=False))
+            if len(fasta):
+                chunk = chunk.iloc[:fasta[0]]
+            chunks.append(chunk.loc[chunk["type"].isin(["polypeptide", "protein_match"]), FEATURE_COLUMNS])
+            if len(fasta):
+                break
+    return pd.concat(chunks) if chunks else pd.DataFrame(columns=FEATURE_COLUMNS)
+
+# Function to parse the GFF file (cached on the file contents so widget reruns don't re-parse it)
+@st.cache_data(show_spinner="Parsing GFF…", max_entries=4)
+def parse_gff(content):
+    # Parse the coordinates to numbers in the C reader; lines without coordinates (directives) become NaN
+    try:
+        gff = read_features(content, "float64")
+    except ValueError:
+        # A comment line has text where the coordinates go, so read them as strings and cast the kept rows
+        gff = read_features(content, str)
+
+    protein_names = gff.loc[gff["type"] == "polypeptide", "seqid"].unique().tolist()
+
+    matches = gff[gff["type"] == "protein_match"]
+    domain_data = pd.DataFrame({
+        "Protein": matches["seqid"].astype("category"),
+        "Start": matches["start"].astype("int32"),
+        "End": matches["end"].astype("int32"),
+        "Domain": matches["attributes"].str.extract(NAME_PATTERN, expand=False).str.strip().fillna("Unknown").astype("category"),
+    }).reset_index(drop=True)
+
+    domain_names = domain_data["Domain"].unique().tolist()
+
+    return domain_data, protein_names, domain_names
 
 # Function to generate random color in hex format
 def random_color():
     return "#{:06x}".format(random.randint(0, 0xFFFFFF))
 
-# Function to plot the protein domains with selected colors
-def plot_domains(domain_data, selected_proteins, selected_domains, shape_choice, domain_colors):
-    filtered_data = [
-        entry for entry in domain_data 
-        if entry[0] in selected_proteins and entry[3] in selected_domains
-    ]
-    
-    df = pd.DataFrame(filtered_data, columns=["Protein", "Start", "End", "Domain"])
+# Function to build the figure of the protein domains with selected colors
+def build_figure(domain_data, selected_proteins, selected_domains, shape_choice, domain_colors):
+    domain_colors = dict(domain_colors)
+
+    # Filter on the integer codes of the categorical columns rather than comparing strings
+    proteins = domain_data["Protein"].array
+    domains = domain_data["Domain"].array
+    protein_codes = proteins.categories.get_indexer(selected_proteins)
+    domain_codes = domains.categories.get_indexer(selected_domains)
+    mask = np.isin(proteins.codes, protein_codes) & np.isin(domains.codes, domain_codes)
+    df = domain_data[mask]
 
     if df.empty:
-        st.info("No domain data found for the selected proteins and domains!")
-        return
+        return None
 
-    fig, ax = plt.subplots(figsize=(10, len(selected_proteins) * 1.5))
+    # Build the figure without pyplot so it is not registered in pyplot's global figure manager
+    fig = Figure(figsize=(10, len(selected_proteins) * 1.5), layout="constrained")
+    ax = fig.subplots()
 
     protein_height = 0.4  
     protein_gap = 1.0     
-
-    for i, protein in enumerate(selected_proteins):
-        y_position = i * (protein_height + protein_gap)
-        protein_rows = df[df['Protein'] == protein]
-
-        for _, row in protein_rows.iterrows():
-            width = row["End"] - row["Start"]
-            alpha_value = 0.6  # Set transparency for overlapping domains
-
-            domain_color = domain_colors.get(row["Domain"], "#1f77b4")  # Default to blue if not specified
-
-            if shape_choice == "Rectangle":
-                ax.add_patch(mpatches.Rectangle((row["Start"], y_position),
-                                                 width, protein_height,
-                                                 color=domain_color,
-                                                 alpha=alpha_value,  # Set transparency
-                                                 label=row["Domain"] if row["Domain"] not in ax.get_legend_handles_labels()[1] else ""))
-            elif shape_choice == "Rounded Rectangle":
-                ax.add_patch(FancyBboxPatch((row["Start"], y_position),
-                                            width, protein_height,
-                                            boxstyle="round,pad=0.02,rounding_size=0.15",
-                                            color=domain_color,
-                                            alpha=alpha_value,  # Set transparency
-                                            label=row["Domain"] if row["Domain"] not in ax.get_legend_handles_labels()[1] else ""))
-            elif shape_choice == "Oval":
-                ax.add_patch(mpatches.Ellipse(((row["Start"] + row["End"]) / 2, y_position + protein_height / 2),
-                                              width, protein_height,
-                                              color=domain_color,
-                                              alpha=alpha_value,  # Set transparency
-                                              label=row["Domain"] if row["Domain"] not in ax.get_legend_handles_labels()[1] else ""))
+    alpha_value = 0.6  # Set transparency for overlapping domains
+
+    # Bottom edge of each selected protein's track
+    y_positions = np.arange(len(selected_proteins)) * (protein_height + protein_gap)
+
+    # Track of every row: a lookup table from protein code to its position in the selection.
+    # Filtering keeps the file order, so the columns are used as they are without sorting or gathering.
+    track_of_code = np.zeros(len(proteins.categories), dtype=np.intp)
+    track_of_code[protein_codes[protein_codes >= 0]] = np.flatnonzero(protein_codes >= 0)
+    ys = y_positions[track_of_code[df["Protein"].array.codes]]
+    starts = df["Start"].to_numpy()
+    ends = df["End"].to_numpy()
+    widths = ends - starts
+
+    # One RGBA row per domain category (default to blue if not specified), looked up by the domain codes.
+    # Only the selected domains are converted; the rows of all other categories are never read.
+    found = domain_codes >= 0
+    palette = np.zeros((len(domains.categories), 4))
+    palette[domain_codes[found]] = to_rgba_array(
+        [domain_colors.get(domain, "#1f77b4") for domain, is_found in zip(selected_domains, found) if is_found])
+    colors = palette[df["Domain"].array.codes]
+
+    if shape_choice == "Rectangle":
+        # Corners of every domain rectangle, filled in one go instead of building a patch per domain
+        verts = np.empty((len(df), 4, 2), dtype=np.float32)
+        verts[:, [0, 3], 0] = starts[:, None]
+        verts[:, [1, 2], 0] = ends[:, None]
+        verts[:, [0, 1], 1] = ys[:, None]
+        verts[:, [2, 3], 1] = ys[:, None] + protein_height
+        domain_shapes = PolyCollection(verts, facecolors=colors, edgecolors=colors, alpha=alpha_value)
+    elif shape_choice == "Rounded Rectangle":
+        boxes = [FancyBboxPatch((start, y), width, protein_height,
+                                boxstyle="round,pad=0.02,rounding_size=0.15",
+                                color=color,
+                                alpha=alpha_value)
+                 for start, y, width, color in zip(starts, ys, widths, colors)]
+        domain_shapes = PatchCollection(boxes, match_original=True)
+    elif shape_choice == "Oval":
+        domain_shapes = EllipseCollection(widths, protein_height, 0, units='xy',
+                                          offsets=np.column_stack(((starts + ends) / 2, ys + protein_height / 2)),
+                                          offset_transform=ax.transData,
+                                          facecolors=colors, edgecolors=colors, alpha=alpha_value)
+
+    ax.add_collection(domain_shapes)
 
     ax.set_xlim(0, df["End"].max() + 10)
     ax.set_ylim(-protein_gap, len(selected_proteins) * (protein_height + protein_gap))
 
-    ax.set_yticks([(i * (protein_height + protein_gap)) + (protein_height / 2) for i in range(len(selected_proteins))])
+    ax.set_yticks(y_positions + protein_height / 2)
     ax.set_yticklabels(selected_proteins)
     ax.set_xlabel("Position on Protein Sequence")
     ax.set_title("Protein Domains Visualization")
@@ -99,9 +149,33 @@ def plot_domains(domain_data, selected_proteins, selected_domains, shape_choice,
     handles = [mpatches.Patch(color=domain_colors[domain], label=domain, alpha=alpha_value) for domain in selected_domains]
     ax.legend(handles=handles, title="Domains", bbox_to_anchor=(1.05, 1), loc='upper left', borderaxespad=0.)
 
-    plt.grid(axis='x')
-    plt.tight_layout()
-    st.pyplot(fig)  # Use Streamlit's method to show the figure
+    ax.grid(axis='x')
+    return fig
+
+# Function to render the protein domain figure as a PNG image
+# (cached, so visualizing an unchanged selection again reuses the rendered image;
+# the parsed data is not hashed, the uploaded file's id identifies it exactly)
+@st.cache_data(max_entries=8)
+def render_png(_domain_data, file_id, selected_proteins, selected_domains, shape_choice, domain_colors):
+    fig = build_figure(_domain_data, selected_proteins, selected_domains, shape_choice, domain_colors)
+    if fig is None:
+        return None
+
+    png = BytesIO()
+    fig.savefig(png, format="png", dpi=200, bbox_inches="tight")  # Same output as st.pyplot
+    return png.getvalue()
+
+# Function to plot the protein domains with selected colors
+def plot_domains(domain_data, file_id, selected_proteins, selected_domains, shape_choice, domain_colors):
+    # Hashable arguments for the figure cache; the protein and domain order is kept as it sets the plot layout
+    colors = tuple((domain, domain_colors[domain]) for domain in selected_domains)
+    png = render_png(domain_data, file_id, tuple(selected_proteins), tuple(selected_domains), shape_choice, colors)
+
+    if png is None:
+        st.info("No domain data found for the selected proteins and domains!")
+        return
+
+    st.image(png)
 
 # Streamlit application
 st.title("Protein Domain Visualizer")
@@ -109,12 +183,12 @@ st.title("Protein Domain Visualizer")
 uploaded_file = st.file_uploader("Select GFF File", type="gff")
 
 if uploaded_file is not None:
-    domain_data, protein_names = parse_gff(uploaded_file)
+    domain_data, protein_names, domain_names = parse_gff(uploaded_file.getvalue())
 
     selected_proteins = st.multiselect("Select Protein(s):", options=list(protein_names))
 
     if selected_proteins:
-        selected_domains = st.multiselect("Select Domain(s):", options=list(set(entry[3] for entry in domain_data)))
+        selected_domains = st.multiselect("Select Domain(s):", options=domain_names)
 
         if selected_domains:
             shape_choice = st.selectbox("Select Domain Shape:", ["Rectangle", "Rounded Rectangle", "Oval"])
@@ -133,4 +207,4 @@ if uploaded_file is not None:
                 st.session_state.domain_colors[domain] = st.color_picker(f"Pick a color for {domain}", st.session_state.domain_colors[domain])
 
             if st.button("Visualize Selected Proteins"):
-                plot_domains(domain_data, selected_proteins, selected_domains, shape_choice, st.session_state.domain_colors)
+                plot_domains(domain_data, uploaded_file.file_id, selected_proteins, selected_domains, shape_choice, st.session_state.domain_colors)